@@ -1,11 +1,18 @@
 # app.py — INSAMAR | Visualizador Ventas (Recauchados 2025)
-# Requiere: streamlit, pandas, openpyxl, plotly
+# Requiere: streamlit, pandas, python-calamine (u openpyxl), pyarrow, plotly
 # Ejecuta: streamlit run app.py
 
+import hashlib
+import tempfile
+from pathlib import Path
+
 import streamlit as st
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
 import plotly.express as px
+import plotly.graph_objects as go
 
 # =========================
 # 0) Config
@@ -28,228 +35,40 @@ COL_MUTED = "#A9B3C7"     # muted
 COL_GRID = "rgba(227,227,232,0.12)"
 COL_DARK_TEXT = "#1A1F2A"  # texto oscuro para inputs blancos
 
+# Caché en disco del Excel ya parseado (Parquet, por hash de contenido)
+CACHE_DIR = Path(".cache")
+CACHE_VERSION = 11  # súbelo cuando cambie el DataFrame que produce _parse_excel
+CACHE_MAX_FILES = 8  # Parquet que se conservan en CACHE_DIR (los de uso más reciente)
+
+# Filas por bloque al escribir el CSV de exportación (acota el pico de memoria)
+CSV_ROWS_PER_CHUNK = 100_000
+
+# Tope de entradas de los cachés por estado de filtros (compartidos entre sesiones): se descartan las
+# más antiguas. El CSV guarda el archivo completo en bytes, por eso conserva menos
+FILTER_CACHE_ENTRIES = 32
+CSV_CACHE_ENTRIES = 4
+
+# Columnas que consumen las vistas (KPIs, gráficos, tablas y export); la carga descarta el resto
+VIEW_COLS = [
+    "Fecha", "Documento", "CodCliente", "Cliente", "Vendedor",
+    "ItemCode", "Producto", "Cantidad", "PrecioUnit", "VentaCLP",
+    "Mes", "Trimestre",
+]
+
 # =========================
 # 2) CSS — estilo “artistico abierto”
 # =========================
+@st.cache_data(show_spinner=False)
+def load_css(path: Path) -> str:
+    return path.read_text(encoding="utf-8")
+
+# Hoja de estilo estática en style.css; sólo la paleta se inyecta desde Python como variables CSS
 st.markdown(
-    f"""
-<style>
-/* ===== Top header transparente (quita barra blanca) ===== */
-header[data-testid="stHeader"] {{
-  background: transparent !important;
-}}
-header[data-testid="stHeader"]::before {{
-  background: transparent !important;
-}}
-div[data-testid="stToolbar"] {{
-  background: transparent !important;
-}}
-div[data-testid="stDecoration"] {{
-  background: transparent !important;
-}}
-/* en algunas versiones, esto también ayuda */
-div[data-testid="stAppViewContainer"] > .main > div:first-child {{
-  background: transparent !important;
-}}
-
-/* Fondo general */
-.stApp {{
-  background: radial-gradient(1200px 700px at 15% 10%, rgba(13,156,216,0.18), transparent 60%),
-              radial-gradient(900px 600px at 80% 30%, rgba(56,103,166,0.18), transparent 55%),
-              linear-gradient(180deg, {COL_BG} 0%, #00081F 100%);
-  color: {COL_TEXT};
-}}
-html, body, [class*="css"] {{ color: {COL_TEXT}; }}
-a {{ color: {COL_ACCENT}; }}
-
-/* Sidebar look */
-section[data-testid="stSidebar"] {{
-  background: linear-gradient(180deg, rgba(0,15,48,0.92), rgba(0,8,31,0.92)) !important;
-  border-right: 1px solid rgba(227,227,232,0.10);
-}}
-
-/* >>> Textos del sidebar (títulos/labels/ayudas) más blancos para contraste */
-section[data-testid="stSidebar"] .stMarkdown,
-section[data-testid="stSidebar"] .stMarkdown p,
-section[data-testid="stSidebar"] h1,
-section[data-testid="stSidebar"] h2,
-section[data-testid="stSidebar"] h3,
-section[data-testid="stSidebar"] h4,
-section[data-testid="stSidebar"] h5,
-section[data-testid="stSidebar"] h6 {{
-  color: rgba(255,255,255,0.92) !important;
-}}
-section[data-testid="stSidebar"] label {{
-  color: rgba(255,255,255,0.92) !important;
-}}
-/* ayuda pequeña (caption/help) */
-section[data-testid="stSidebar"] .stCaption,
-section[data-testid="stSidebar"] small,
-section[data-testid="stSidebar"] [data-testid="stTooltipIcon"] {{
-  color: rgba(255,255,255,0.85) !important;
-}}
-
-/* Panel “vidrio” */
-.panel {{
-  background: rgba(3,26,70,0.35);
-  border: 1px solid rgba(227,227,232,0.14);
-  border-radius: 18px;
-  padding: 16px 16px 10px 16px;
-  box-shadow: 0 16px 40px rgba(0,0,0,0.30);
-}}
-
-/* Header marca */
-.brand {{
-  display:flex; align-items:center; gap:14px;
-  margin: 4px 0 10px 0;
-}}
-.badge {{
-  width: 44px; height: 44px; border-radius: 14px;
-  background: linear-gradient(135deg, rgba(13,156,216,0.95), rgba(56,103,166,0.95));
-  box-shadow: 0 12px 30px rgba(0,0,0,0.35);
-  position: relative;
-  overflow:hidden;
-}}
-.badge:before {{
-  content:"";
-  position:absolute; inset:-40%;
-  background: radial-gradient(circle at 30% 30%, rgba(255,255,255,0.55), transparent 45%);
-  transform: rotate(20deg);
-}}
-.title {{
-  font-size: 28px; font-weight: 800; letter-spacing: 0.6px;
-}}
-.subtitle {{
-  margin-top:-6px;
-  font-size: 13px; color: {COL_MUTED};
-}}
-
-/* KPIs */
-.kpi-grid {{
-  display:grid;
-  grid-template-columns: repeat(5, minmax(160px, 1fr));
-  gap: 12px;
-  margin: 10px 0 8px 0;
-}}
-.kpi {{
-  background: rgba(3,26,70,0.35);
-  border: 1px solid rgba(227,227,232,0.14);
-  border-radius: 16px;
-  padding: 12px 12px 10px 12px;
-}}
-.kpi .label {{
-  font-size: 12px;
-  color: {COL_MUTED};
-  margin-bottom: 6px;
-}}
-.kpi .value {{
-  font-size: 22px;
-  font-weight: 800;
-  letter-spacing: 0.2px;
-}}
-.kpi .hint {{
-  font-size: 11px;
-  color: rgba(227,227,232,0.65);
-  margin-top: 6px;
-}}
-
-/* File uploader dropzone */
-div[data-testid="stFileUploaderDropzone"] {{
-  background: rgba(3,26,70,0.35) !important;
-  border: 1px dashed rgba(227,227,232,0.22) !important;
-  border-radius: 18px !important;
-}}
-div[data-testid="stFileUploaderDropzone"] * {{
-  color: {COL_TEXT} !important;
-}}
-div[data-testid="stFileUploaderDropzone"] button {{
-  background: rgba(13,156,216,0.18) !important;
-  color: {COL_TEXT} !important;
-  border: 1px solid rgba(13,156,216,0.55) !important;
-  border-radius: 14px !important;
-}}
-
-/* Botones Streamlit (incluye download) */
-.stButton > button,
-div[data-testid="stDownloadButton"] > button {{
-  background: linear-gradient(135deg, rgba(13,156,216,0.35), rgba(56,103,166,0.35)) !important;
-  color: {COL_TEXT} !important;
-  border: 1px solid rgba(227,227,232,0.18) !important;
-  border-radius: 14px !important;
-  box-shadow: 0 10px 24px rgba(0,0,0,0.25) !important;
-}}
-.stButton > button:hover,
-div[data-testid="stDownloadButton"] > button:hover {{
-  border: 1px solid rgba(13,156,216,0.55) !important;
-}}
-
-/* ===== Widgets generales (mantén estilo oscuro en main) ===== */
-div[data-baseweb="base-input"] > div {{
-  background: rgba(3,26,70,0.35) !important;
-  border: 1px solid rgba(227,227,232,0.18) !important;
-  border-radius: 14px !important;
-}}
-div[data-baseweb="base-input"] input,
-div[data-baseweb="base-input"] textarea {{
-  background: transparent !important;
-  color: {COL_TEXT} !important;
-}}
-div[data-baseweb="select"] > div {{
-  background: rgba(3,26,70,0.35) !important;
-  border: 1px solid rgba(227,227,232,0.18) !important;
-  border-radius: 14px !important;
-}}
-div[data-baseweb="select"] * {{
-  color: {COL_TEXT} !important;
-}}
-
-/* Date picker popover */
-div[data-baseweb="popover"] > div {{
-  background: rgba(0,15,48,0.98) !important;
-  border: 1px solid rgba(227,227,232,0.18) !important;
-}}
-
-/* Slider track */
-div[data-testid="stSlider"] [data-baseweb="slider"] > div {{
-  background: rgba(227,227,232,0.14) !important;
-}}
-
-/* Dataframes */
-div[data-testid="stDataFrame"] {{
-  background: rgba(3,26,70,0.20) !important;
-  border-radius: 14px !important;
-}}
-
-/* ===== Sidebar: inputs blancos con texto oscuro (para que 950 y fechas se lean) ===== */
-section[data-testid="stSidebar"] div[data-baseweb="base-input"] > div {{
-  background: rgba(255,255,255,0.96) !important;
-  border: 1px solid rgba(227,227,232,0.25) !important;
-}}
-section[data-testid="stSidebar"] div[data-baseweb="base-input"] input,
-section[data-testid="stSidebar"] div[data-baseweb="base-input"] textarea {{
-  color: {COL_DARK_TEXT} !important;
-}}
-section[data-testid="stSidebar"] div[data-baseweb="base-input"] input::placeholder {{
-  color: rgba(26,31,42,0.55) !important;
-}}
-/* iconos dentro de inputs (calendario, etc.) */
-section[data-testid="stSidebar"] div[data-baseweb="base-input"] svg {{
-  fill: rgba(26,31,42,0.70) !important;
-}}
-/* botones + / - del number_input */
-section[data-testid="stSidebar"] div[data-baseweb="base-input"] button {{
-  color: rgba(26,31,42,0.85) !important;
-}}
-
-/* Mantén selects/multiselect oscuros (se leen bien) */
-section[data-testid="stSidebar"] div[data-baseweb="select"] > div {{
-  background: rgba(3,26,70,0.35) !important;
-}}
-section[data-testid="stSidebar"] div[data-baseweb="select"] * {{
-  color: {COL_TEXT} !important;
-}}
-</style>
-    """,
+    "<style>\n"
+    f":root {{ --col-bg: {COL_BG}; --col-text: {COL_TEXT}; --col-accent: {COL_ACCENT}; "
+    f"--col-muted: {COL_MUTED}; --col-dark-text: {COL_DARK_TEXT}; }}\n"
+    + load_css(Path(__file__).with_name("style.css"))
+    + "</style>",
     unsafe_allow_html=True,
 )
 
@@ -266,26 +85,81 @@ def _fmt_usd(x: float) -> str:
         return "—"
     return f"US$ {x:,.0f}"
 
-def _safe_col(df: pd.DataFrame, candidates: list[str]) -> str | None:
-    cols = {c.lower(): c for c in df.columns}
+def _lower_cols(df: pd.DataFrame) -> tuple[dict[str, str], list[tuple[str, str]]]:
+    lc_cols = [(c.lower(), c) for c in df.columns]
+    return dict(lc_cols), lc_cols
+
+def _safe_col(lc_map: dict[str, str], lc_cols: list[tuple[str, str]], candidates: list[str]) -> str | None:
     for cand in candidates:
-        if cand.lower() in cols:
-            return cols[cand.lower()]
+        if cand.lower() in lc_map:
+            return lc_map[cand.lower()]
     for cand in candidates:
-        for c in df.columns:
-            if cand.lower() in c.lower():
+        cand = cand.lower()
+        for lc, c in lc_cols:
+            if cand in lc:
                 return c
     return None
 
-@st.cache_data(show_spinner=False)
-def load_data_from_excel(file) -> pd.DataFrame:
-    df = pd.read_excel(file, sheet_name="Data venta")
+# Columnas de "Data venta" que usa el visualizador: nombre interno -> nombres posibles en el Excel
+COL_CANDIDATES = {
+    "Documento": ["Número interno", "Numero interno", "DocNum", "Documento"],
+    "CodCliente": ["Código de cliente/proveedor", "Codigo de cliente", "CardCode"],
+    "Cliente": ["Nombre de cliente/proveedor", "Nombre de cliente", "CardName"],
+    "Vendedor": ["SlpName", "Vendedor", "Ejecutivo"],
+    "ItemCode": ["ItemCode", "Codigo item", "Item"],
+    "Producto": ["Dscription", "Descripcion", "Description"],
+    "Cantidad": ["Quantity", "Cantidad"],
+    "PrecioUnit": ["Price", "Precio"],
+    "VentaCLP": ["Venta", "Total", "Monto"],
+}
+_COL_HINTS = tuple({"fecha"} | {cand.lower() for cands in COL_CANDIDATES.values() for cand in cands})
+
+def _is_used_col(name) -> bool:
+    name = str(name).lower()
+    return any(hint in name for hint in _COL_HINTS)
+
+def _read_sheet(file) -> pd.DataFrame:
+    # calamine (Rust) lee sin construir el DOM de openpyxl; openpyxl queda de respaldo si no está instalado.
+    # Sin dtype_backend="pyarrow": falla con columnas que mezclan números y texto; el paso a Arrow va después
+    kwargs = dict(sheet_name="Data venta", usecols=_is_used_col)
+    try:
+        return pd.read_excel(file, engine="calamine", **kwargs)
+    except ImportError:
+        if hasattr(file, "seek"):
+            file.seek(0)
+        return pd.read_excel(file, engine="openpyxl", **kwargs)
+
+def _to_number(s: pd.Series) -> pd.Series:
+    # Numérico sin nulos; si todos los valores son enteros se reduce al entero más chico que los contiene
+    # (menos bytes por fila en filtros y agregaciones; las sumas igual acumulan en 64 bits)
+    s = pd.to_numeric(s, errors="coerce").fillna(0)
+    return pd.to_numeric(s, downcast="integer")
+
+def _period_categorical(ordinal: np.ndarray, per_year: int, fmt: str) -> pd.Categorical:
+    # Mes/Trimestre como ordinal entero (año * períodos + período): sólo se formatean las k etiquetas
+    # del rango, no un string por fila, y el orden de las categorías es el cronológico
+    lo, hi = (int(ordinal.min()), int(ordinal.max())) if len(ordinal) else (0, -1)
+    labels = [fmt.format(y=o // per_year, p=o % per_year + 1) for o in range(lo, hi + 1)]
+    return pd.Categorical.from_codes(ordinal - lo, categories=labels)
+
+def _source_key(file) -> str:
+    h = hashlib.blake2b(f"v{CACHE_VERSION}".encode(), digest_size=16)
+    if hasattr(file, "getbuffer"):
+        h.update(file.getbuffer())
+    else:
+        path = Path(file)
+        stat = path.stat()
+        h.update(f"{path.resolve()}|{stat.st_mtime_ns}|{stat.st_size}".encode())
+    return h.hexdigest()
+
+def _parse_excel(file) -> pd.DataFrame:
+    df = _read_sheet(file)
 
     # Fecha
-    col_date = _safe_col(df, ["Fecha de contabilización", "Fecha"])
+    col_date = _safe_col(*_lower_cols(df), ["Fecha de contabilización", "Fecha"])
     if col_date:
         df[col_date] = pd.to_datetime(df[col_date], errors="coerce")
-        df = df[df[col_date].notna()].copy()
+        df.dropna(subset=[col_date], inplace=True)
         df.rename(columns={col_date: "Fecha"}, inplace=True)
     else:
         for c in df.columns:
@@ -293,19 +167,13 @@ def load_data_from_excel(file) -> pd.DataFrame:
                 df[c] = pd.to_datetime(df[c], errors="coerce")
                 if df[c].notna().any():
                     df.rename(columns={c: "Fecha"}, inplace=True)
-                    df = df[df["Fecha"].notna()].copy()
+                    df.dropna(subset=["Fecha"], inplace=True)
                     break
 
+    lc_map, lc_cols = _lower_cols(df)
     rename_map = {}
-    rename_map[_safe_col(df, ["Número interno", "Numero interno", "DocNum", "Documento"])] = "Documento"
-    rename_map[_safe_col(df, ["Código de cliente/proveedor", "Codigo de cliente", "CardCode"])] = "CodCliente"
-    rename_map[_safe_col(df, ["Nombre de cliente/proveedor", "Nombre de cliente", "CardName"])] = "Cliente"
-    rename_map[_safe_col(df, ["SlpName", "Vendedor", "Ejecutivo"])] = "Vendedor"
-    rename_map[_safe_col(df, ["ItemCode", "Codigo item", "Item"])] = "ItemCode"
-    rename_map[_safe_col(df, ["Dscription", "Descripcion", "Description"])] = "Producto"
-    rename_map[_safe_col(df, ["Quantity", "Cantidad"])] = "Cantidad"
-    rename_map[_safe_col(df, ["Price", "Precio"])] = "PrecioUnit"
-    rename_map[_safe_col(df, ["Venta", "Total", "Monto"])] = "VentaCLP"
+    for target, candidates in COL_CANDIDATES.items():
+        rename_map[_safe_col(lc_map, lc_cols, candidates)] = target
 
     rename_map = {k: v for k, v in rename_map.items() if k is not None}
     df.rename(columns=rename_map, inplace=True)
@@ -315,29 +183,251 @@ def load_data_from_excel(file) -> pd.DataFrame:
     if missing:
         raise ValueError(f"Faltan columnas esperadas: {missing}. Revisa la hoja 'Data venta'.")
 
-    df["Cantidad"] = pd.to_numeric(df["Cantidad"], errors="coerce").fillna(0)
-    df["PrecioUnit"] = pd.to_numeric(df["PrecioUnit"], errors="coerce").fillna(0)
-    df["VentaCLP"] = pd.to_numeric(df["VentaCLP"], errors="coerce").fillna(0)
-
-    df["Año"] = df["Fecha"].dt.year
-    df["Mes"] = df["Fecha"].dt.to_period("M").astype(str)
-    df["Trimestre"] = df["Fecha"].dt.to_period("Q").astype(str)
-    df["TicketPromCLP"] = np.where(df["Cantidad"] > 0, df["VentaCLP"] / df["Cantidad"], np.nan)
-
+    df["Cantidad"] = _to_number(df["Cantidad"])
+    df["PrecioUnit"] = _to_number(df["PrecioUnit"])
+    df["VentaCLP"] = _to_number(df["VentaCLP"])
+
+    year = df["Fecha"].dt.year.to_numpy(dtype=np.int32)
+    month0 = df["Fecha"].dt.month.to_numpy(dtype=np.int32) - 1
+    df["Mes"] = _period_categorical(year * 12 + month0, 12, "{y}-{p:02d}")
+    df["Trimestre"] = _period_categorical(year * 4 + month0 // 3, 4, "{y}Q{p}")
+
+    # read_excel deja como object las columnas de texto y las que mezclan números y texto
+    # (p. ej. un Documento 1, "A-2", 3): aquí pasan a string de Arrow, con los números como texto
+    for c in df.columns:
+        if df[c].dtype == object:
+            df[c] = df[c].astype("string[pyarrow]")
+
+    # Dimensiones de baja cardinalidad como categóricas: groupby/filtros trabajan sobre códigos enteros.
+    # Las categorías van siempre como string: Parquet sólo conserva como diccionario las de texto, y una
+    # dimensión numérica (p. ej. Dscription con códigos) volvería del caché como int64, sin .cat
+    for c in ("CodCliente", "Cliente", "Vendedor", "ItemCode", "Producto"):
+        if c in df.columns:
+            df[c] = df[c].astype("string[pyarrow]").astype("category")
+
+    # Orden por fecha descendente una sola vez por archivo: el filtrado por máscara lo conserva
+    present = set(df.columns)
+    df = df[[c for c in VIEW_COLS if c in present]]
+    return df.sort_values("Fecha", ascending=False, kind="stable", ignore_index=True)
+
+def _prune_cache_dir(keep: int) -> None:
+    # Deja sólo los `keep` Parquet de uso más reciente (mtime): cada subida distinta y cada cambio de
+    # CACHE_VERSION dejan un archivo que ya nadie vuelve a pedir
+    def mtime(path: Path) -> float:
+        try:
+            return path.stat().st_mtime
+        except FileNotFoundError:
+            return 0.0  # otra sesión lo borró entre el glob y el stat
+
+    for old in sorted(CACHE_DIR.glob("*.parquet"), key=mtime, reverse=True)[keep:]:
+        old.unlink(missing_ok=True)
+
+# Los argumentos con "_" no se hashean: la clave de caché es data_key (hash del archivo) y filter_key
+@st.cache_data(show_spinner=False)
+def load_data_from_excel(_file, data_key: str) -> pd.DataFrame:
+    cache_path = CACHE_DIR / f"{data_key}.parquet"
+    if cache_path.exists():
+        try:
+            df = pd.read_parquet(cache_path)
+        except Exception:
+            cache_path.unlink(missing_ok=True)  # Parquet ilegible: se descarta y se vuelve a leer el Excel
+        else:
+            try:
+                cache_path.touch()  # marca el uso, para que _prune_cache_dir no lo descarte primero
+            except OSError:
+                pass
+            return df
+
+    df = _parse_excel(_file)
+    tmp_path = None
+    try:
+        CACHE_DIR.mkdir(exist_ok=True)
+        # Temporal único por escritura: dos sesiones cargando el mismo archivo no se pisan el .tmp
+        with tempfile.NamedTemporaryFile(dir=CACHE_DIR, suffix=".tmp", delete=False) as tmp:
+            tmp_path = Path(tmp.name)
+            df.to_parquet(tmp, engine="pyarrow", compression="zstd")
+        tmp_path.replace(cache_path)
+        _prune_cache_dir(CACHE_MAX_FILES)
+    except Exception:
+        # el caché en disco es opcional: si no se puede escribir, seguimos con el DataFrame en memoria
+        if tmp_path is not None:
+            tmp_path.unlink(missing_ok=True)
     return df
 
+_KPI_TPL = (
+    '<div class="kpi">'
+    '<div class="label">{0}</div>'
+    '<div class="value">{1}</div>'
+    '<div class="hint">{2}</div>'
+    '</div>'
+)
+
 def kpi_cards(kpis: list[tuple[str, str, str]]):
-    parts = ['<div class="kpi-grid">']
-    for label, value, hint in kpis:
-        parts.append(
-            f'<div class="kpi">'
-            f'<div class="label">{label}</div>'
-            f'<div class="value">{value}</div>'
-            f'<div class="hint">{hint}</div>'
-            f'</div>'
-        )
-    parts.append("</div>")
-    st.markdown("".join(parts), unsafe_allow_html=True)
+    st.markdown(
+        '<div class="kpi-grid">' + "".join(_KPI_TPL.format(*k) for k in kpis) + "</div>",
+        unsafe_allow_html=True,
+    )
+
+def _sum_by_codes(codes: np.ndarray, n: int, values: pd.Series) -> np.ndarray:
+    out = np.bincount(codes, weights=values.to_numpy(dtype=np.float64), minlength=n)
+    return out.astype(np.int64) if pd.api.types.is_integer_dtype(values.dtype) else out
+
+def _count_distinct(codes: np.ndarray, n: int, values: pd.Series) -> np.ndarray:
+    # nunique por grupo: pares (grupo, valor) únicos sobre enteros factorizados, contados por grupo.
+    # pd.unique deduplica con tabla hash en una pasada (np.unique ordenaba: O(n log n)); el conteo es exacto
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Las categóricas ya traen sus ids enteros desde la carga: no se re-factoriza en cada llamada
+        ids, m = values.cat.codes.to_numpy(), len(values.cat.categories)
+    else:
+        ids, uniques = pd.factorize(values)
+        m = len(uniques)
+    valid = (ids >= 0) & (codes >= 0)
+    m = max(m, 1)
+    pairs = pd.unique(codes[valid].astype(np.int64) * m + ids[valid])
+    return np.bincount(pairs // m, minlength=n)
+
+def _agg_by_codes(dff: pd.DataFrame, col: str, clientes: bool = False) -> pd.DataFrame:
+    # Agregación por los códigos de una columna categórica con np.bincount (sin groupby de pandas):
+    # una pasada lineal por columna sobre arrays contiguos, sin despacho por grupo
+    codes = dff[col].cat.codes.to_numpy()
+    categories = dff[col].cat.categories
+    if (codes < 0).any():
+        keep = codes >= 0
+        dff, codes = dff[keep], codes[keep]
+    n = len(categories)
+    seen = np.bincount(codes, minlength=n) > 0
+    out = {
+        col: categories[seen],
+        "VentaCLP": _sum_by_codes(codes, n, dff["VentaCLP"])[seen],
+        "Unidades": _sum_by_codes(codes, n, dff["Cantidad"])[seen],
+        "Docs": _count_distinct(codes, n, dff["Documento"])[seen],
+    }
+    if clientes:
+        out["Clientes"] = _count_distinct(codes, n, dff["Cliente"])[seen]
+    return pd.DataFrame(out)
+
+def _isin_categories(s: pd.Series, values: list[str]) -> np.ndarray:
+    # isin sobre los códigos enteros de la categórica, sin hashear strings por fila
+    wanted = s.cat.categories.get_indexer(values)
+    return np.isin(s.cat.codes.to_numpy(), wanted[wanted >= 0])
+
+@st.cache_data(show_spinner=False)
+def unique_sorted(_df: pd.DataFrame, data_key: str, col: str) -> list[str]:
+    # Las categorías ya son únicas y ordenadas: O(k) una vez por archivo, no O(n) por rerun
+    return _df[col].cat.categories.tolist()
+
+@st.cache_data(show_spinner=False, max_entries=FILTER_CACHE_ENTRIES)
+def agg_kpis(_dff: pd.DataFrame, filter_key: tuple) -> tuple[float, float, float, int, int]:
+    # Una sola pasada por columna: las sumas se reutilizan para el precio promedio
+    total_clp = float(_dff["VentaCLP"].to_numpy().sum())
+    total_qty = float(_dff["Cantidad"].to_numpy().sum())
+    avg_unit = total_clp / max(total_qty, 1)
+    docs = int(_dff["Documento"].nunique())
+    custs = int(_dff["Cliente"].nunique())
+    return total_clp, total_qty, avg_unit, docs, custs
+
+@st.cache_data(show_spinner=False, max_entries=FILTER_CACHE_ENTRIES)
+def agg_by_month(_dff: pd.DataFrame, filter_key: tuple) -> pd.DataFrame:
+    # Las categorías de "Mes" (AAAA-MM) ya vienen ordenadas: el resultado sale en orden cronológico
+    return _agg_by_codes(_dff, "Mes")
+
+@st.cache_data(show_spinner=False, max_entries=FILTER_CACHE_ENTRIES)
+def agg_summary(_dff: pd.DataFrame, filter_key: tuple, group_col: str) -> pd.DataFrame:
+    # Todas las dimensiones agrupables son categóricas: mismo camino por códigos que la tendencia mensual
+    return _agg_by_codes(_dff, group_col, clientes=True)
+
+@st.cache_data(show_spinner=False, max_entries=FILTER_CACHE_ENTRIES)
+def detail_rows(_dff: pd.DataFrame, filter_key: tuple) -> pa.Table:
+    # dff hereda el orden por fecha descendente de la carga: las 2000 más recientes son las primeras.
+    # Se cachea ya como tabla Arrow, que st.dataframe serializa sin reconvertir desde pandas en cada rerun
+    return pa.Table.from_pandas(_dff.head(2000), preserve_index=False)
+
+@st.cache_data(show_spinner=False, max_entries=CSV_CACHE_ENTRIES)
+def export_csv(_dff: pd.DataFrame, filter_key: tuple, export_cols: tuple[str, ...]) -> bytes:
+    # Writer CSV de Arrow (C++, multihilo): escribe UTF-8 directo, sin pasar por un str de Python.
+    # Se convierte y escribe por bloques de CSV_ROWS_PER_CHUNK filas para no duplicar el pico de memoria.
+    view = _dff.loc[:, list(export_cols)]
+    schema = pa.Schema.from_pandas(view, preserve_index=False)
+    out_schema = schema
+    i_fecha = schema.get_field_index("Fecha")
+    if i_fecha >= 0:
+        # Fecha con el mismo formato que to_csv: AAAA-MM-DD si no hay horas; si las hay, la unidad más
+        # gruesa que no pierde nada (segundos o milisegundos), no los microsegundos que escribe Arrow
+        fecha = view["Fecha"].to_numpy()
+        for unit, fecha_type in (("D", pa.date32()), ("s", pa.timestamp("s")), ("ms", pa.timestamp("ms"))):
+            if (fecha == fecha.astype(f"datetime64[{unit}]")).all():
+                out_schema = schema.set(i_fecha, pa.field("Fecha", fecha_type))
+                break
+
+    buf = pa.BufferOutputStream()
+    with pacsv.CSVWriter(buf, out_schema) as writer:
+        for start in range(0, len(view), CSV_ROWS_PER_CHUNK):
+            chunk = view.iloc[start:start + CSV_ROWS_PER_CHUNK]
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False).cast(out_schema))
+    return buf.getvalue().to_pybytes()
+
+# Figuras cacheadas como dict: Plotly Express sólo se ejecuta cuando cambian los datos agregados
+@st.cache_data(show_spinner=False, max_entries=FILTER_CACHE_ENTRIES)
+def build_trend_fig(ts: pd.DataFrame) -> dict:
+    fig_ts = px.line(
+        ts,
+        x="Mes",
+        y="VentaCLP",
+        markers=True,
+        hover_data={"Unidades": True, "Docs": True, "VentaCLP": ":,.0f"},
+    )
+    fig_ts.update_layout(
+        height=380,
+        paper_bgcolor="rgba(0,0,0,0)",
+        plot_bgcolor="rgba(0,0,0,0)",
+        font=dict(color=COL_TEXT),
+        xaxis=dict(showgrid=False),
+        yaxis=dict(showgrid=True, gridcolor=COL_GRID),
+        margin=dict(l=10, r=10, t=10, b=10),
+    )
+    return fig_ts.to_dict()
+
+@st.cache_data(show_spinner=False, max_entries=FILTER_CACHE_ENTRIES)
+def build_price_hist_fig(_dff: pd.DataFrame, filter_key: tuple) -> dict:
+    # Bins calculados aquí: al navegador viajan 40 barras, no una fila por venta
+    precios = _dff["PrecioUnit"].to_numpy()
+    counts, edges = np.histogram(precios[precios > 0], bins=40)
+    fig_hist = px.bar(
+        x=(edges[:-1] + edges[1:]) / 2,
+        y=counts,
+        labels={"x": "PrecioUnit", "y": "count"},
+    )
+    fig_hist.update_layout(
+        height=330,
+        bargap=0,
+        paper_bgcolor="rgba(0,0,0,0)",
+        plot_bgcolor="rgba(0,0,0,0)",
+        font=dict(color=COL_TEXT),
+        xaxis=dict(showgrid=False),
+        yaxis=dict(showgrid=True, gridcolor=COL_GRID),
+        margin=dict(l=10, r=10, t=10, b=10),
+    )
+    return fig_hist.to_dict()
+
+@st.cache_data(show_spinner=False, max_entries=FILTER_CACHE_ENTRIES)
+def build_top_fig(top: pd.DataFrame, group_col: str) -> dict:
+    fig_top = px.bar(
+        top.sort_values("VentaCLP", ascending=True),
+        x="VentaCLP",
+        y=group_col,
+        orientation="h",
+        hover_data={"Unidades": True, "Docs": True, "VentaCLP": ":,.0f"},
+    )
+    fig_top.update_layout(
+        height=720,
+        paper_bgcolor="rgba(0,0,0,0)",
+        plot_bgcolor="rgba(0,0,0,0)",
+        font=dict(color=COL_TEXT),
+        xaxis=dict(showgrid=True, gridcolor=COL_GRID),
+        yaxis=dict(showgrid=False),
+        margin=dict(l=10, r=10, t=10, b=10),
+    )
+    return fig_top.to_dict()
 
 # =========================
 # 4) Header
@@ -371,7 +461,8 @@ default_path = "Venta Recauchados 2025 (18 dic).xlsx"
 
 try:
     data_source = uploaded if uploaded is not None else default_path
-    df = load_data_from_excel(data_source)
+    data_key = _source_key(data_source)
+    df = load_data_from_excel(data_source, data_key)
 except Exception as e:
     st.error(f"No pude cargar la hoja 'Data venta'. Detalle: {e}")
     st.stop()
@@ -392,8 +483,8 @@ with st.sidebar:
         max_value=max_d,
     )
 
-    clientes = sorted(df["Cliente"].dropna().unique().tolist())
-    vendedores = sorted(df["Vendedor"].dropna().unique().tolist())
+    clientes = unique_sorted(df, data_key, "Cliente")
+    vendedores = unique_sorted(df, data_key, "Vendedor")
 
     sel_clientes = st.multiselect("Cliente(s)", options=clientes, default=[])
     sel_vendedores = st.multiselect("Vendedor(es)", options=vendedores, default=[])
@@ -413,24 +504,34 @@ with st.sidebar:
     )
     top_n = st.slider("Top N (clientes/productos)", 5, 30, 12)
 
-mask = (df["Fecha"].dt.date >= d1) & (df["Fecha"].dt.date <= d2)
-if sel_clientes:
-    mask &= df["Cliente"].isin(sel_clientes)
-if sel_vendedores:
-    mask &= df["Vendedor"].isin(sel_vendedores)
-if txt_producto.strip():
-    mask &= df["Producto"].astype(str).str.contains(txt_producto.strip(), case=False, na=False)
-
-dff = df[mask].copy()
+txt_producto = txt_producto.strip()
+
+if not sel_clientes and not sel_vendedores and not txt_producto and (d1, d2) == (min_d, max_d):
+    # Sin filtros activos: no se arma la máscara ni se copian filas (las vistas sólo leen dff)
+    dff = df
+else:
+    # Rango [d1, d2 + 1 día) comparado directo sobre el buffer datetime64 (sin objetos date por fila)
+    fecha = df["Fecha"].to_numpy()
+    mask = (fecha >= np.datetime64(d1)) & (fecha < np.datetime64(d2) + np.timedelta64(1, "D"))
+    if sel_clientes:
+        mask &= _isin_categories(df["Cliente"], sel_clientes)
+    if sel_vendedores:
+        mask &= _isin_categories(df["Vendedor"], sel_vendedores)
+    if txt_producto:
+        # Busca el texto literal en las categorías (k únicos) y lo proyecta a las filas vía códigos;
+        # astype(str) cubre categorías no texto (p. ej. Dscription numérico) y sólo toca las k categorías.
+        # El False agregado al final cubre el código -1 (producto vacío)
+        hits = df["Producto"].cat.categories.astype(str).str.contains(txt_producto, case=False, regex=False)
+        hits = np.append(np.asarray(hits, dtype=bool), False)
+        mask &= hits[df["Producto"].cat.codes.to_numpy()]
+    dff = df[mask]
+
+filter_key = (data_key, d1, d2, tuple(sel_clientes), tuple(sel_vendedores), txt_producto)
 
 # =========================
 # 7) KPIs principales
 # =========================
-total_clp = float(dff["VentaCLP"].sum())
-total_qty = float(dff["Cantidad"].sum())
-avg_unit = float(dff["VentaCLP"].sum() / max(dff["Cantidad"].sum(), 1))
-docs = int(dff["Documento"].nunique())
-custs = int(dff["Cliente"].nunique())
+total_clp, total_qty, avg_unit, docs, custs = agg_kpis(dff, filter_key)
 
 kpis = [
     ("Venta total (CLP)", _fmt_clp(total_clp), "Suma de “Venta” en el rango filtrado"),
@@ -461,51 +562,15 @@ with colA:
     st.markdown("#### 📈 Evolución de ventas (tendencia)")
     st.caption("Comportamiento temporal. Útil para estacionalidad, quiebres o picos de demanda.")
 
-    ts = (
-        dff.groupby("Mes", as_index=False)
-        .agg(VentaCLP=("VentaCLP", "sum"), Unidades=("Cantidad", "sum"), Docs=("Documento", "nunique"))
-        .sort_values("Mes")
-    )
-
-    fig_ts = px.line(
-        ts,
-        x="Mes",
-        y="VentaCLP",
-        markers=True,
-        hover_data={"Unidades": True, "Docs": True, "VentaCLP": ":,.0f"},
-    )
-    fig_ts.update_layout(
-        height=380,
-        paper_bgcolor="rgba(0,0,0,0)",
-        plot_bgcolor="rgba(0,0,0,0)",
-        font=dict(color=COL_TEXT),
-        xaxis=dict(showgrid=False),
-        yaxis=dict(showgrid=True, gridcolor=COL_GRID),
-        margin=dict(l=10, r=10, t=10, b=10),
-    )
-    st.plotly_chart(fig_ts, use_container_width=True)
+    ts = agg_by_month(dff, filter_key)
+    st.plotly_chart(go.Figure(build_trend_fig(ts)), use_container_width=True)
     st.markdown("</div>", unsafe_allow_html=True)
 
     st.markdown('<div class="panel">', unsafe_allow_html=True)
     st.markdown("#### 🧪 Distribución de precios unitarios")
     st.caption("Detecta outliers y rangos típicos (por unidad).")
 
-    fig_hist = px.histogram(
-        dff[dff["PrecioUnit"] > 0],
-        x="PrecioUnit",
-        nbins=40,
-        hover_data=["Producto", "Cliente", "Vendedor"],
-    )
-    fig_hist.update_layout(
-        height=330,
-        paper_bgcolor="rgba(0,0,0,0)",
-        plot_bgcolor="rgba(0,0,0,0)",
-        font=dict(color=COL_TEXT),
-        xaxis=dict(showgrid=False),
-        yaxis=dict(showgrid=True, gridcolor=COL_GRID),
-        margin=dict(l=10, r=10, t=10, b=10),
-    )
-    st.plotly_chart(fig_hist, use_container_width=True)
+    st.plotly_chart(go.Figure(build_price_hist_fig(dff, filter_key)), use_container_width=True)
     st.markdown("</div>", unsafe_allow_html=True)
 
 with colB:
@@ -521,30 +586,10 @@ with colB:
         "Producto": "Producto",
     }[group_main]
 
-    top = (
-        dff.groupby(group_col, as_index=False)
-        .agg(VentaCLP=("VentaCLP", "sum"), Unidades=("Cantidad", "sum"), Docs=("Documento", "nunique"))
-        .sort_values("VentaCLP", ascending=False)
-        .head(top_n)
-    )
-
-    fig_top = px.bar(
-        top.sort_values("VentaCLP", ascending=True),
-        x="VentaCLP",
-        y=group_col,
-        orientation="h",
-        hover_data={"Unidades": True, "Docs": True, "VentaCLP": ":,.0f"},
-    )
-    fig_top.update_layout(
-        height=720,
-        paper_bgcolor="rgba(0,0,0,0)",
-        plot_bgcolor="rgba(0,0,0,0)",
-        font=dict(color=COL_TEXT),
-        xaxis=dict(showgrid=True, gridcolor=COL_GRID),
-        yaxis=dict(showgrid=False),
-        margin=dict(l=10, r=10, t=10, b=10),
-    )
-    st.plotly_chart(fig_top, use_container_width=True)
+    # Una sola agregación por grupo alimenta el ranking y la tabla resumen de la sección 9
+    summary = agg_summary(dff, filter_key, group_col)
+    top = summary.nlargest(top_n, "VentaCLP")
+    st.plotly_chart(go.Figure(build_top_fig(top, group_col)), use_container_width=True)
     st.markdown("</div>", unsafe_allow_html=True)
 
 st.markdown("---")
@@ -552,44 +597,32 @@ st.markdown("---")
 # =========================
 # 9) Tablas (director-ready)
 # =========================
-gcols = [group_col] if group_col in dff.columns else ["Cliente"]
-
-summary = (
-    dff.groupby(gcols, as_index=False)
-    .agg(
-        VentaCLP=("VentaCLP", "sum"),
-        Unidades=("Cantidad", "sum"),
-        Docs=("Documento", "nunique"),
-        Clientes=("Cliente", "nunique"),
-    )
-)
-summary["PrecioPromCLP"] = np.where(summary["Unidades"] > 0, summary["VentaCLP"] / summary["Unidades"], np.nan)
-summary = summary.sort_values("VentaCLP", ascending=False)
-
 c1, c2 = st.columns([1, 1], gap="large")
 
 with c1:
     st.markdown('<div class="panel">', unsafe_allow_html=True)
     st.markdown("#### Resumen agregado")
-    st.dataframe(summary.head(40), use_container_width=True, hide_index=True)
+    # El precio promedio sólo se calcula para las 40 filas que se muestran
+    resumen = summary.nlargest(40, "VentaCLP")
+    # np.divide con where: no divide (ni avisa) donde Unidades es 0; esas filas quedan en NaN
+    unidades = resumen["Unidades"].to_numpy(dtype=np.float64)
+    precio = np.full(len(resumen), np.nan)
+    np.divide(resumen["VentaCLP"].to_numpy(dtype=np.float64), unidades, out=precio, where=unidades > 0)
+    resumen = resumen.assign(PrecioPromCLP=precio)
+    st.dataframe(resumen, use_container_width=True, hide_index=True)
     st.markdown("</div>", unsafe_allow_html=True)
 
 with c2:
     st.markdown('<div class="panel">', unsafe_allow_html=True)
     st.markdown("#### Detalle (filtrado)")
-    st.dataframe(dff.sort_values("Fecha", ascending=False).head(2000), use_container_width=True, hide_index=True)
+    st.dataframe(detail_rows(dff, filter_key), use_container_width=True, hide_index=True)
     st.markdown("</div>", unsafe_allow_html=True)
 
 # =========================
 # 10) Export
 # =========================
-export_cols = [
-    "Fecha", "Documento", "CodCliente", "Cliente", "Vendedor",
-    "ItemCode", "Producto", "Cantidad", "PrecioUnit", "VentaCLP",
-    "Mes", "Trimestre",
-]
-export_cols = [c for c in export_cols if c in dff.columns]
-csv_bytes = dff[export_cols].to_csv(index=False).encode("utf-8")
+# dff ya viene proyectado a VIEW_COLS desde la carga: se exportan sus columnas tal cual
+csv_bytes = export_csv(dff, filter_key, tuple(dff.columns))
 
 st.download_button(
     "⬇️ Descargar datos filtrados (CSV)",